@@ -1,27 +1,28 @@
 import logging
 import json
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters, ConversationHandler
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto, InlineQueryResultArticle, InputTextMessageContent
+from telegram.ext import Application, CommandHandler, CallbackQueryHandler, MessageHandler, ContextTypes, filters, ConversationHandler, TypeHandler, InlineQueryHandler
 import requests
 from config import *
 from database import Database
+from catalog import Catalog
+from broadcast import Broadcaster
+from manifest import parse_manifest, ManifestError
+from logging_config import setup_logging, correlation_id
+from coordination import Coordinator, JobWorker
+from ratelimit import KeyedRateLimiter, TokenBucket, is_valid_signature
+from charts import charts_available, render_revenue_chart
 import telegram
 import asyncio
 import os
+import re
+import time
 from dotenv import load_dotenv
 
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
+# Enable logging (queued, written by a background thread)
+setup_logging()
 logger = logging.getLogger(__name__)
 
-# Add file handler for persistent logging
-file_handler = logging.FileHandler('bot.log')
-file_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-logger.addHandler(file_handler)
-
 # Load environment variables
 load_dotenv()
 
@@ -36,19 +37,53 @@ if missing_vars:
 # Conversation states for adding products
 TITLE, DESCRIPTION, PRICE, PHOTO, DOWNLOAD_CONTENT = range(5)
 
-# Initialize database
-try:
-    db = Database()
-    logger.info("Database connection established successfully")
-except Exception as e:
-    logger.error(f"Failed to initialize database: {e}")
-    raise
+# Conversation state for importing a product manifest
+IMPORT_FILE = 5
+
+# Reply when a payment signature has already been claimed
+SIGNATURE_USED_TEXT = (
+    "❌ This transaction signature has already been used. Each payment can only be used once.\n\n"
+    "If this was your purchase, use /mypurchases to get it again."
+)
+
+# Database tables are initialized in main(), alongside the Telegram client,
+# so importing this module never touches the network
+db = Database()
+
+# Per-process product cache, invalidated across instances via LISTEN/NOTIFY
+catalog = Catalog(db)
+
+# Shared HTTP session so Helius calls reuse one TLS connection
+helius_session = requests.Session()
+
+# Limits on signature submissions, checked before any database or RPC work
+signature_user_limiter = KeyedRateLimiter(SIGNATURE_USER_BURST, SIGNATURE_USER_RATE, RATE_LIMIT_MAX_USERS)
+signature_global_limiter = TokenBucket(SIGNATURE_GLOBAL_BURST, SIGNATURE_GLOBAL_RATE)
+
+async def set_correlation_id(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Tag every log record written while handling this update with its update ID."""
+    correlation_id.set(update.update_id)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send welcome message when the command /start is issued."""
     # Reset product index when starting
     context.user_data['current_product_index'] = 0
     
+    # Deep link from an inline search result: t.me/<bot>?start=buy_<id>
+    if context.args and re.fullmatch(r'buy_\d+', context.args[0]):
+        product = catalog.get_product(int(context.args[0][4:]))
+        if product:
+            keyboard = [
+                [InlineKeyboardButton(f"💳 Buy Now ({product['price']} SOL)", callback_data=f'buy_{product["id"]}')],
+                [InlineKeyboardButton("🛍 Browse Store", callback_data='browse')]
+            ]
+            await update.message.reply_text(
+                format_product_text(product),
+                reply_markup=InlineKeyboardMarkup(keyboard),
+                parse_mode='Markdown'
+            )
+            return
+    
     keyboard = [
         [InlineKeyboardButton("🛍 Browse Store", callback_data='browse')]
     ]
@@ -62,12 +97,21 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         parse_mode='Markdown'
     )
 
+def format_product_text(product, call_to_action="Click the button below to purchase!"):
+    """Build the Markdown product card shown in the store."""
+    return (
+        f"*🎯 {product['title']}*\n\n"
+        f"💰 *Price:* {product['price']} SOL\n\n"
+        f"📝 *Description:*\n{product['description']}\n\n"
+        f"{call_to_action}"
+    )
+
 async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show available products."""
     query = update.callback_query
     
-    # Get all products from database
-    products = db.get_all_products()
+    # Get all products from the catalog cache
+    products = catalog.get_products()
     if not products:
         await query.message.edit_text(
             "📭 No products available at the moment.",
@@ -105,12 +149,7 @@ async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
     
-    product_text = (
-        f"*🎯 {product['title']}*\n\n"
-        f"💰 *Price:* {product['price']} SOL\n\n"
-        f"📝 *Description:*\n{product['description']}\n\n"
-        f"Click the button below to purchase!"
-    )
+    product_text = format_product_text(product)
     
     if product.get('photo_id'):
         await query.message.edit_media(
@@ -128,6 +167,34 @@ async def show_products(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
+async def inline_search(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Answer inline queries (@bot <query>) with matching products."""
+    query = update.inline_query
+    
+    # Only plain words reach the tsquery, so user input can't break its syntax
+    terms = re.findall(r'\w+', query.query.lower())[:8]
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    products = db.search_products(terms, INLINE_RESULTS_LIMIT, offset)
+    
+    results = []
+    for product in products:
+        deep_link = f"https://t.me/{context.bot.username}?start=buy_{product['id']}"
+        results.append(InlineQueryResultArticle(
+            id=str(product['id']),
+            title=f"{product['title']} ({product['price']} SOL)",
+            description=(product['description'] or '')[:100],
+            input_message_content=InputTextMessageContent(
+                format_product_text(product, "Tap the button below to buy it in the store!"),
+                parse_mode='Markdown'
+            ),
+            reply_markup=InlineKeyboardMarkup([
+                [InlineKeyboardButton(f"💳 Buy Now ({product['price']} SOL)", url=deep_link)]
+            ])
+        ))
+    
+    next_offset = str(offset + INLINE_RESULTS_LIMIT) if len(products) == INLINE_RESULTS_LIMIT else ''
+    await query.answer(results, cache_time=INLINE_CACHE_TIME, next_offset=next_offset)
+
 async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button presses."""
     query = update.callback_query
@@ -138,7 +205,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     elif query.data.startswith('buy_'):
         # Extract product ID from callback data
         product_id = int(query.data.split('_')[1])
-        product = db.get_product_by_id(product_id)
+        product = catalog.get_product(product_id)
         
         if not product:
             await query.message.edit_text(
@@ -173,6 +240,7 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         product_id = int(query.data.split('_')[1])
         context.user_data['current_product_id'] = product_id
         context.user_data['waiting_for_signature'] = True
+        context.user_data.pop('pending_signature', None)
         
         await query.message.reply_text(
             "📝 Please paste the transaction signature to verify your payment.\n\n"
@@ -188,10 +256,57 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "❌ Product removal cancelled.",
             parse_mode='Markdown'
         )
+    elif query.data.startswith('announce_'):
+        if update.effective_user.id != ADMIN_IDS:
+            return
+        
+        product_id = int(query.data.split('_')[1])
+        product = catalog.get_product(product_id)
+        if not product:
+            await query.message.reply_text("❌ Product not found.")
+            return
+        
+        announcement = (
+            f"🆕 *New in TeenBucks Store: {product['title']}*\n\n"
+            f"{product['description']}\n\n"
+            f"💰 *Price:* {product['price']} SOL\n\n"
+            f"Send /start to check it out!"
+        )
+        broadcast_id = db.create_broadcast(announcement, product.get('photo_id'), query.message.chat_id)
+        # Drop the button so a second tap can't announce twice
+        await query.message.edit_reply_markup(reply_markup=None)
+        start_broadcast(broadcast_id)
+        
+        await query.message.reply_text(
+            f"📣 *Announcement queued*\n\n"
+            f"Sending to {db.count_buyer_ids()} buyers. You'll get a report when it's done.",
+            parse_mode='Markdown'
+        )
+    elif query.data.startswith('redeliver_'):
+        # Ownership is checked in the query, so users can only fetch their own purchases
+        purchase_id = int(query.data.split('_')[1])
+        purchase = db.get_purchase(purchase_id, update.effective_user.id)
+        if not purchase:
+            await query.message.reply_text("❌ Purchase not found.")
+            return
+        
+        await send_product_content(
+            context.bot,
+            query.message.chat_id,
+            purchase,
+            f"📥 *{purchase['title']}*"
+        )
     elif query.data.startswith('remove_'):
         # Handle product removal
-        product_title = query.data.replace('remove_', '')
-        db.remove_product(product_title)
+        product_id = query.data.replace('remove_', '')
+        product_title = db.remove_product(int(product_id)) if product_id.isdigit() else None
+        catalog.invalidate()
+        if product_title is None:
+            await query.message.edit_text(
+                "❌ Product not found. It may have already been removed.",
+                parse_mode='Markdown'
+            )
+            return
         
         # Update the message to show removal confirmation
         await query.message.edit_text(
@@ -200,25 +315,62 @@ async def button_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
+async def check_signature_submission(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Throttle and sanity-check a signature before any database or RPC work.
+
+    Returns False (after replying to the user) if the submission is rejected.
+    """
+    wait = signature_user_limiter.consume(update.effective_user.id)
+    if wait:
+        # Only tell the user once per cooldown so spamming doesn't cost us replies too
+        now = time.monotonic()
+        if context.user_data.get('cooldown_until', 0) < now:
+            context.user_data['cooldown_until'] = now + wait
+            await update.message.reply_text(
+                f"⏳ Too many attempts. Please wait {wait:.0f} seconds before sending another signature."
+            )
+        return False
+    
+    # Validate signature format
+    if not is_valid_signature(update.message.text.strip()):
+        await update.message.reply_text(
+            "❌ Invalid transaction signature format. Please provide a valid Solana transaction signature."
+        )
+        return False
+    
+    wait = signature_global_limiter.consume()
+    if wait:
+        logger.warning("Global signature verification limit reached")
+        await update.message.reply_text(
+            f"⏳ We're verifying a lot of payments right now. Please try again in {max(wait, 1):.0f} seconds."
+        )
+        return False
+    
+    return True
+
 async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Verify the transaction signature."""
     if not context.user_data.get('waiting_for_signature'):
         return
     
-    signature = update.message.text.strip()
+    # The verification job can't reach user_data, so settle the last submission
+    # here: once its signature is recorded the purchase is over. If it failed
+    # the buyer stays in signature mode and can paste a corrected one.
+    pending_signature = context.user_data.get('pending_signature')
+    if pending_signature and db.is_signature_used(pending_signature):
+        context.user_data['waiting_for_signature'] = False
+        context.user_data.pop('current_product_id', None)
+        context.user_data.pop('pending_signature', None)
+        return
     
-    # Validate signature format
-    if not signature or len(signature) < 32:
-        await update.message.reply_text(
-            "❌ Invalid transaction signature format. Please provide a valid Solana transaction signature."
-        )
+    if not await check_signature_submission(update, context):
         return
     
+    signature = update.message.text.strip()
+    
     # Check if signature was already used
     if db.is_signature_used(signature):
-        await update.message.reply_text(
-            "❌ This transaction signature has already been used. Each payment can only be used once."
-        )
+        await update.message.reply_text(SIGNATURE_USED_TEXT)
         return
     
     # Get the product being purchased
@@ -229,7 +381,7 @@ async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return
         
-    product = db.get_product_by_id(product_id)
+    product = catalog.get_product(product_id)
     if not product:
         await update.message.reply_text(
             "❌ Product not found. Please try again."
@@ -241,13 +393,76 @@ async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "⏳ Verifying your payment... Please wait."
     )
     
+    # Hand the on-chain check to the shared job queue so any instance can run it
+    db.enqueue_job('verify_payment', {
+        'chat_id': update.effective_chat.id,
+        'message_id': processing_msg.message_id,
+        'reply_to_message_id': update.message.message_id,
+        'user_id': update.effective_user.id,
+        'username': update.effective_user.username or str(update.effective_user.id),
+        'product_id': product_id,
+        'signature': signature
+    })
+    context.user_data['pending_signature'] = signature
+
+async def send_product_content(bot: telegram.Bot, chat_id, product, heading, reply_to_message_id=None):
+    """Send a product's file or download link."""
+    if product.get('is_file'):
+        await bot.send_document(
+            chat_id=chat_id,
+            reply_to_message_id=reply_to_message_id,
+            document=product['download_content'],
+            caption=f"{heading}\n\n"
+                    "Here's your purchased file!",
+            parse_mode='Markdown'
+        )
+    elif product.get('download_content'):
+        await bot.send_message(
+            chat_id,
+            f"{heading}\n\n"
+            f"Here's your download link:\n{product['download_content']}",
+            reply_to_message_id=reply_to_message_id,
+            parse_mode='Markdown'
+        )
+    else:
+        await bot.send_message(
+            chat_id,
+            f"{heading}\n\n"
+            "Thank you for your purchase!",
+            reply_to_message_id=reply_to_message_id,
+            parse_mode='Markdown'
+        )
+
+async def verify_payment(bot: telegram.Bot, payload):
+    """Verify a payment on chain and deliver the product (runs as a queued job)."""
+    chat_id = payload['chat_id']
+    message_id = payload['message_id']
+    signature = payload['signature']
+    product_id = payload['product_id']
+    
+    async def edit_status(text):
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    
+    # Cheap early exit before the RPC call; save_purchase below is the real guard
+    if db.is_signature_used(signature):
+        logger.info(f"Signature {signature} already processed, skipping")
+        await edit_status(SIGNATURE_USED_TEXT)
+        return
+    
+    product = db.get_product_by_id(product_id)
+    if not product:
+        await edit_status("❌ Product not found. Please try again.")
+        return
+    
     # Verify transaction using Helius API with retries
     max_retries = 3
     retry_delay = 2  # seconds
     
     for attempt in range(max_retries):
         try:
-            response = requests.post(
+            # Run the blocking request in a thread so other jobs and updates keep flowing
+            response = await asyncio.to_thread(
+                helius_session.post,
                 HELIUS_RPC_URL,
                 json={
                     "jsonrpc": "2.0",
@@ -267,67 +482,53 @@ async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
                     
                     # Check if transaction is confirmed
                     if not tx_result.get('meta', {}).get('status', {}).get('Ok'):
-                        await processing_msg.edit_text(
+                        await edit_status(
                             "❌ Transaction is not confirmed yet. Please wait a few moments and try again."
                         )
                         return
                     
+                    # Save the purchase first: only the job that claims the
+                    # signature delivers, even if several verify it at once
+                    if not db.save_purchase(payload['user_id'], payload['username'], product_id, signature):
+                        await edit_status(SIGNATURE_USED_TEXT)
+                        return
+                    
                     # Send the product content
                     try:
-                        if product.get('is_file'):
-                            await update.message.reply_document(
-                                document=product['download_content'],
-                                caption="✅ *Payment verified! Thank you for your purchase.*\n\n"
-                                       "Here's your purchased file!",
-                                parse_mode='Markdown'
-                            )
-                        elif product.get('download_content'):
-                            await update.message.reply_text(
-                                "✅ *Payment verified! Thank you for your purchase.*\n\n"
-                                f"Here's your download link:\n{product['download_content']}",
-                                parse_mode='Markdown'
-                            )
-                        else:
-                            await update.message.reply_text(
-                                "✅ *Payment verified! Thank you for your purchase.*\n\n"
-                                "Thank you for your purchase!",
-                                parse_mode='Markdown'
-                            )
-                        
-                        # Save purchase record
-                        user_id = update.effective_user.id
-                        username = update.effective_user.username or str(user_id)
-                        db.save_purchase(user_id, username, product_id, signature)
-                        
-                        # Clear the waiting state
-                        context.user_data['waiting_for_signature'] = False
-                        context.user_data.pop('current_product_id', None)
+                        await send_product_content(
+                            bot,
+                            chat_id,
+                            product,
+                            "✅ *Payment verified! Thank you for your purchase.*",
+                            reply_to_message_id=payload['reply_to_message_id']
+                        )
                         
                         # Delete processing message
-                        await processing_msg.delete()
+                        await bot.delete_message(chat_id, message_id)
                         return
                         
                     except Exception as e:
                         logger.error(f"Error sending product content: {e}")
-                        await processing_msg.edit_text(
-                            "❌ Error delivering product content. Please contact support."
+                        await edit_status(
+                            "❌ Error delivering product content. Your purchase is saved, "
+                            "use /mypurchases to get it or contact support."
                         )
                         return
                 
-                await processing_msg.edit_text(
+                await edit_status(
                     "❌ Transaction not found. Please make sure you've sent the correct signature."
                 )
                 return
                 
             elif response.status_code == 429:  # Rate limit
                 if attempt < max_retries - 1:
-                    await processing_msg.edit_text(
+                    await edit_status(
                         f"⏳ Rate limit reached. Retrying in {retry_delay} seconds..."
                     )
                     await asyncio.sleep(retry_delay)
                     continue
                 else:
-                    await processing_msg.edit_text(
+                    await edit_status(
                         "❌ Rate limit reached. Please try again in a few minutes."
                     )
                     return
@@ -335,13 +536,13 @@ async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
             else:
                 logger.error(f"Helius API error: {response.status_code} - {response.text}")
                 if attempt < max_retries - 1:
-                    await processing_msg.edit_text(
+                    await edit_status(
                         f"⏳ Error occurred. Retrying in {retry_delay} seconds..."
                     )
                     await asyncio.sleep(retry_delay)
                     continue
                 else:
-                    await processing_msg.edit_text(
+                    await edit_status(
                         "❌ Error verifying transaction. Please try again later."
                     )
                     return
@@ -349,13 +550,13 @@ async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
         except requests.exceptions.Timeout:
             logger.error("Helius API request timed out")
             if attempt < max_retries - 1:
-                await processing_msg.edit_text(
+                await edit_status(
                     f"⏳ Request timed out. Retrying in {retry_delay} seconds..."
                 )
                 await asyncio.sleep(retry_delay)
                 continue
             else:
-                await processing_msg.edit_text(
+                await edit_status(
                     "❌ Request timed out. Please try again later."
                 )
                 return
@@ -363,25 +564,25 @@ async def verify_transaction(update: Update, context: ContextTypes.DEFAULT_TYPE)
         except requests.exceptions.RequestException as e:
             logger.error(f"Network error during transaction verification: {e}")
             if attempt < max_retries - 1:
-                await processing_msg.edit_text(
+                await edit_status(
                     f"⏳ Network error. Retrying in {retry_delay} seconds..."
                 )
                 await asyncio.sleep(retry_delay)
                 continue
             else:
-                await processing_msg.edit_text(
+                await edit_status(
                     "❌ Network error occurred. Please check your internet connection and try again."
                 )
                 return
                 
         except Exception as e:
             logger.error(f"Unexpected error during transaction verification: {e}")
-            await processing_msg.edit_text(
+            await edit_status(
                 "❌ An unexpected error occurred. Please try again later."
             )
             return
     
-    await processing_msg.edit_text(
+    await edit_status(
         "❌ Failed to verify transaction after multiple attempts. Please try again later."
     )
 
@@ -475,6 +676,7 @@ async def add_product_content(update: Update, context: ContextTypes.DEFAULT_TYPE
     
     # Save the new product to database
     product_id = db.save_product(context.user_data['new_product'])
+    catalog.invalidate()
     
     # Clear the temporary data
     new_product = context.user_data.pop('new_product')
@@ -489,20 +691,76 @@ async def add_product_content(update: Update, context: ContextTypes.DEFAULT_TYPE
         "The product is now available in the store!"
     )
     
+    keyboard = [
+        [InlineKeyboardButton("📣 Announce to Buyers", callback_data=f'announce_{product_id}')]
+    ]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
     if new_product.get('photo_id'):
         await update.message.reply_photo(
             photo=new_product['photo_id'],
             caption=confirmation_text,
+            reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     else:
         await update.message.reply_text(
             confirmation_text,
+            reply_markup=reply_markup,
             parse_mode='Markdown'
         )
     
     return ConversationHandler.END
 
+async def import_products_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start a bulk product import (admin only)."""
+    if update.effective_user.id != ADMIN_IDS:
+        await update.message.reply_text("❌ Unauthorized access.")
+        return ConversationHandler.END
+    
+    await update.message.reply_text(
+        "📦 *Bulk Product Import*\n\n"
+        "Please send a CSV or JSON manifest file.\n\n"
+        "Columns: `title`, `description`, `price`, `photo_id`, "
+        "`download_content`, `is_file`, `file_name`\n"
+        "Only `title` and `price` are required. Products whose title "
+        "already exists are skipped.\n\n"
+        "Send /cancel to abort.",
+        parse_mode='Markdown'
+    )
+    return IMPORT_FILE
+
+async def import_products_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Validate the uploaded manifest and insert all of its products at once."""
+    document = update.message.document
+    manifest_file = await document.get_file()
+    data = bytes(await manifest_file.download_as_bytearray())
+    
+    try:
+        products = parse_manifest(data, document.file_name)
+    except ManifestError as e:
+        # Cap the list so the reply stays under Telegram's message size limit
+        errors = "\n".join(f"• {error}" for error in e.errors[:20])
+        if len(e.errors) > 20:
+            errors += f"\n• ...and {len(e.errors) - 20} more"
+        await update.message.reply_text(
+            f"❌ Import failed, nothing was added.\n\n{errors}\n\n"
+            "Fix the manifest and send it again, or /cancel."
+        )
+        return IMPORT_FILE
+    
+    created, skipped = db.save_products(products)
+    catalog.invalidate()
+    logger.info(f"Imported {len(created)} products, skipped {len(skipped)}")
+    
+    await update.message.reply_text(
+        "✅ *Import Complete*\n\n"
+        f"📦 *Created:* {len(created)}\n"
+        f"⏭ *Skipped (duplicate title):* {len(skipped)}",
+        parse_mode='Markdown'
+    )
+    return ConversationHandler.END
+
 async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show store statistics (admin only)."""
     if update.effective_user.id != ADMIN_IDS:
@@ -511,16 +769,97 @@ async def show_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     total_sales = db.get_total_sales()
     buyers = db.get_buyers()
-    products = db.get_all_products()
+    products = catalog.get_products()
+    nodes = db.get_active_nodes(HEARTBEAT_INTERVAL * 3)
     
     stats = (
         "*📊 Store Statistics*\n\n"
         f"👥 *Total Buyers:* {len(buyers)}\n"
         f"💰 *Total Sales:* {total_sales} SOL\n"
-        f"📦 *Active Products:* {len(products)}"
+        f"📦 *Active Products:* {len(products)}\n"
+        f"🖥 *Bot Instances:* {len(nodes)}"
     )
     await update.message.reply_text(stats, parse_mode='Markdown')
 
+async def rollup_sales(context: ContextTypes.DEFAULT_TYPE):
+    """Roll new purchases into the analytics tables (runs on the JobQueue)."""
+    total = 0
+    while True:
+        count = await asyncio.to_thread(db.rollup_sales, ROLLUP_BATCH_SIZE)
+        total += count
+        if count < ROLLUP_BATCH_SIZE:
+            break
+    if total:
+        logger.info(f"Rolled up {total} purchases into sales analytics")
+
+async def show_revenue(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show revenue by hour, day, week or product from the rollups (admin only)."""
+    if update.effective_user.id != ADMIN_IDS:
+        await update.message.reply_text("❌ Unauthorized access.")
+        return
+    
+    args = [arg.lower() for arg in context.args]
+    want_chart = 'chart' in args
+    args = [arg for arg in args if arg != 'chart']
+    period = args[0] if args else 'day'
+    
+    if period not in REVENUE_DEFAULT_COUNTS or (len(args) > 1 and not args[1].isdigit()):
+        await update.message.reply_text(
+            "📈 *Usage:* `/revenue [hour|day|week|product] [count] [chart]`\n\n"
+            "• `/revenue day 30` - last 30 days\n"
+            "• `/revenue week 12 chart` - last 12 weeks as a chart\n"
+            "• `/revenue product 7` - per product over the last 7 days",
+            parse_mode='Markdown'
+        )
+        return
+    
+    count = int(args[1]) if len(args) > 1 else REVENUE_DEFAULT_COUNTS[period]
+    count = max(1, min(count, REVENUE_MAX_COUNT))
+    
+    if period == 'product':
+        rows = db.get_revenue_by_product(count)
+        labels = [title for title, _, _ in rows]
+        heading = f"*📈 Revenue by Product (last {count} days)*"
+    else:
+        rows = db.get_revenue(period, count)
+        label_format = {'hour': '%m-%d %H:00', 'day': '%Y-%m-%d', 'week': 'Week of %Y-%m-%d'}[period]
+        labels = [bucket.strftime(label_format) for bucket, _, _ in rows]
+        heading = f"*📈 Revenue by {period.capitalize()} (last {count})*"
+    
+    if not rows:
+        await update.message.reply_text("📭 No sales in this period yet.")
+        return
+    
+    total_sales = sum(sales for _, sales, _ in rows)
+    total_revenue = sum(revenue for _, _, revenue in rows)
+    lines = [
+        f"`{label}` — {sales} sales, {revenue:.2f} SOL"
+        for label, (_, sales, revenue) in zip(labels, rows)
+    ]
+    # Keep the reply under Telegram's message size limit
+    if len(lines) > 50:
+        lines = lines[-50:] if period != 'product' else lines[:50]
+    
+    await update.message.reply_text(
+        f"{heading}\n\n"
+        + "\n".join(lines)
+        + f"\n\n💰 *Total:* {total_sales} sales, {total_revenue:.2f} SOL\n"
+        f"_Updated every {ROLLUP_INTERVAL // 60} minutes_",
+        parse_mode='Markdown'
+    )
+    
+    if want_chart:
+        if not charts_available():
+            await update.message.reply_text("❌ Charts need matplotlib installed on the server.")
+            return
+        chart = await asyncio.to_thread(
+            render_revenue_chart,
+            labels,
+            [revenue for _, _, revenue in rows],
+            heading.strip('*')
+        )
+        await update.message.reply_photo(photo=chart)
+
 async def show_buyers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Show buyer list (admin only)."""
     if update.effective_user.id != ADMIN_IDS:
@@ -538,6 +877,90 @@ async def show_buyers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     await update.message.reply_text(buyers_list, parse_mode='Markdown')
 
+async def broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Broadcast a message to all buyers (admin only)."""
+    if update.effective_user.id != ADMIN_IDS:
+        await update.message.reply_text("❌ Unauthorized access.")
+        return
+    
+    # Keep the admin's line breaks, which context.args would discard
+    message = update.message.text.partition(' ')[2].strip()
+    if not message:
+        await update.message.reply_text(
+            "📣 *Usage:* `/broadcast <message>`\n\n"
+            "The message is sent to every buyer and supports Markdown.",
+            parse_mode='Markdown'
+        )
+        return
+    
+    # Send a preview first so bad Markdown fails here instead of for every buyer
+    try:
+        await update.message.reply_text(message, parse_mode='Markdown')
+    except telegram.error.BadRequest as e:
+        await update.message.reply_text(f"❌ Invalid message formatting: {e}")
+        return
+    
+    broadcast_id = db.create_broadcast(message, admin_chat_id=update.effective_chat.id)
+    start_broadcast(broadcast_id)
+    
+    await update.message.reply_text(
+        f"📣 *Broadcast queued*\n\n"
+        f"The preview above is being sent to {db.count_buyer_ids()} buyers. "
+        f"You'll get a report when it's done.",
+        parse_mode='Markdown'
+    )
+
+def start_broadcast(broadcast_id):
+    """Queue a broadcast for whichever instance picks it up first."""
+    db.enqueue_job('broadcast', {'broadcast_id': broadcast_id})
+
+async def run_broadcast(bot: telegram.Bot, payload):
+    """Deliver a broadcast and report the results to the admin who started it (runs as a queued job)."""
+    broadcast_id = payload['broadcast_id']
+    stats = await Broadcaster(bot, db).run(broadcast_id)
+    logger.info(f"Broadcast {broadcast_id} finished: {stats}")
+    
+    admin_chat_id = db.get_broadcast(broadcast_id)['admin_chat_id'] or ADMIN_IDS
+    try:
+        await bot.send_message(
+            chat_id=admin_chat_id,
+            text=(
+                f"*📣 Broadcast #{broadcast_id} Finished*\n\n"
+                f"✅ *Delivered:* {stats['sent']}\n"
+                f"🚫 *Blocked the bot:* {stats['blocked']}\n"
+                f"❌ *Failed:* {stats['failed']}\n"
+                f"⏱ *Time:* {stats['elapsed']:.1f}s ({stats['rate']:.1f} msg/s)"
+            ),
+            parse_mode='Markdown'
+        )
+    except Exception as e:
+        logger.error(f"Failed to send broadcast report: {e}")
+
+async def my_purchases(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """List the user's purchases with buttons to get each one again."""
+    purchases = db.get_purchases_by_user(update.effective_user.id)
+    if not purchases:
+        await update.message.reply_text(
+            "📭 You haven't bought anything yet.\n\n"
+            "Send /start to browse the store!"
+        )
+        return
+    
+    # Telegram caps inline keyboards at 100 buttons
+    keyboard = []
+    for purchase in purchases[:50]:
+        keyboard.append([InlineKeyboardButton(
+            f"📥 {purchase['title']} ({purchase['purchase_date']:%Y-%m-%d})",
+            callback_data=f"redeliver_{purchase['id']}"
+        )])
+    
+    await update.message.reply_text(
+        "*🧾 Your Purchases*\n\n"
+        "Tap a purchase to get your file or link again.",
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode='Markdown'
+    )
+
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Cancel the current operation."""
     context.user_data.pop('new_product', None)
@@ -553,7 +976,7 @@ async def remove_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ Unauthorized access.")
         return
     
-    products = db.get_all_products()
+    products = catalog.get_products()
     if not products:
         await update.message.reply_text("📭 No products available to remove.")
         return
@@ -562,7 +985,7 @@ async def remove_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     for product in products:
         keyboard.append([InlineKeyboardButton(
             f"🗑 {product['title']} ({product['price']} SOL)",
-            callback_data=f"remove_{product['title']}"
+            callback_data=f"remove_{product['id']}"
         )])
     
     keyboard.append([InlineKeyboardButton("❌ Cancel", callback_data='cancel_remove')])
@@ -577,23 +1000,22 @@ async def remove_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle errors in the bot."""
-    # Log the full error with traceback
-    logger.error("Exception while handling an update:", exc_info=context.error)
-    
     # Get detailed error information
     error_type = type(context.error).__name__
     error_message = str(context.error)
     
-    # Log specific error details
-    logger.error(f"Error type: {error_type}")
-    logger.error(f"Error message: {error_message}")
+    # Log the full error with traceback; the update ID is attached by the logging pipeline
+    logger.error(f"Exception while handling an update: {error_type}: {error_message}", exc_info=context.error)
     
-    if update:
-        logger.error(f"Update: {update.to_dict()}")
+    # Dumping the whole update is expensive, so only do it when debugging
+    if isinstance(update, Update) and logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"Update: {update.to_dict()}")
     
     # Handle specific error types
     if isinstance(context.error, telegram.error.Conflict):
-        logger.error("Bot instance conflict detected. Please ensure only one instance is running.")
+        # Expected briefly during poller failover; persistent conflicts mean an
+        # instance is polling without going through the Coordinator
+        logger.error("Bot instance conflict detected. Another instance is polling with this token.")
         return
     
     elif isinstance(context.error, telegram.error.NetworkError):
@@ -612,7 +1034,7 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
             )
         return
     
-    elif isinstance(context.error, telegram.error.Unauthorized):
+    elif isinstance(context.error, telegram.error.InvalidToken):
         logger.error("Bot token is invalid or has been revoked.")
         return
     
@@ -644,6 +1066,15 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 
 async def main():
     """Start the bot."""
+    timings = {}
+    phase_started = time.perf_counter()
+    
+    def end_phase(name):
+        nonlocal phase_started
+        now = time.perf_counter()
+        timings[name] = now - phase_started
+        phase_started = now
+    
     # Create the Application
     application = Application.builder().token(BOT_TOKEN).build()
     
@@ -670,35 +1101,107 @@ async def main():
         fallbacks=[CommandHandler('cancel', cancel)]
     )
 
+    # Add conversation handler for bulk importing products
+    import_handler = ConversationHandler(
+        entry_points=[CommandHandler('import', import_products_start)],
+        states={
+            IMPORT_FILE: [MessageHandler(filters.Document.ALL, import_products_file)],
+        },
+        fallbacks=[CommandHandler('cancel', cancel)]
+    )
+
+    # Tag logs with the update ID before any other handler runs
+    application.add_handler(TypeHandler(Update, set_correlation_id), group=-1)
+
     # Add handlers
     application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("mypurchases", my_purchases))
     application.add_handler(conv_handler)
+    application.add_handler(import_handler)
     application.add_handler(CommandHandler("remove", remove_product))
     application.add_handler(CommandHandler("stats", show_stats))
     application.add_handler(CommandHandler("buyers", show_buyers))
+    application.add_handler(CommandHandler("revenue", show_revenue))
+    application.add_handler(CommandHandler("broadcast", broadcast))
     application.add_handler(CallbackQueryHandler(button_handler))
+    application.add_handler(InlineQueryHandler(inline_search))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, verify_transaction))
 
     # Add error handler
     application.add_error_handler(error_handler)
+    
+    # Keep sales analytics rolled up. Safe on every instance: rollups lock the watermark.
+    application.job_queue.run_repeating(rollup_sales, interval=ROLLUP_INTERVAL, first=10)
+    end_phase('handlers')
+
+    coordinator = None
+    background_tasks = []
 
     try:
-        # Clean up any existing webhooks
-        logger.info("Cleaning up existing webhooks...")
-        await application.bot.delete_webhook(drop_pending_updates=True)
+        # Bring up the database and the Telegram client concurrently
+        logger.info("Initializing database and Telegram client...")
+        await asyncio.gather(
+            asyncio.to_thread(db.init_db),
+            application.initialize()
+        )
+        end_phase('init')
         
-        # Start polling
-        logger.info("Starting polling...")
-        await application.initialize()
         await application.start()
-        await application.run_polling(allowed_updates=Update.ALL_TYPES)
+        end_phase('start')
+        
+        async def start_polling():
+            # Updates sent while no instance was polling are kept and
+            # processed instead of being dropped
+            logger.info("Starting polling...")
+            await application.updater.start_polling(
+                allowed_updates=Update.ALL_TYPES,
+                drop_pending_updates=False
+            )
+        
+        async def stop_polling():
+            if application.updater.running:
+                logger.info("Stopping polling...")
+                await application.updater.stop()
+        
+        # Every instance runs queued jobs; only the elected one polls Telegram
+        coordinator = Coordinator(db)
+        worker = JobWorker(db, {
+            'verify_payment': lambda payload: verify_payment(application.bot, payload),
+            'broadcast': lambda payload: run_broadcast(application.bot, payload),
+        })
+        background_tasks = [
+            asyncio.create_task(coordinator.run(start_polling, stop_polling)),
+            asyncio.create_task(worker.run()),
+            asyncio.create_task(catalog.listen())
+        ]
+        
+        logger.info(
+            f"Node {NODE_ID} started in {sum(timings.values()):.2f}s ("
+            + ", ".join(f"{name}: {seconds:.2f}s" for name, seconds in timings.items())
+            + ")"
+        )
+        
+        # Run until the process is stopped
+        await asyncio.gather(*background_tasks)
     except Exception as e:
         logger.error(f"Error during bot operation: {e}", exc_info=True)
         raise
     finally:
         # Ensure proper cleanup
         logger.info("Stopping bot application...")
-        await application.stop()
+        for task in background_tasks:
+            task.cancel()
+        if application.updater.running:
+            await application.updater.stop()
+        if coordinator is not None:
+            coordinator.release()
+            try:
+                db.remove_node(NODE_ID)
+            except Exception as e:
+                logger.error(f"Failed to deregister node: {e}")
+        if application.running:
+            await application.stop()
+        await application.shutdown()
 
 if __name__ == '__main__':
     try:
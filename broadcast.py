@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+
+import telegram
+
+from config import BROADCAST_RATE, BROADCAST_BATCH_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Hand out evenly spaced send slots and pause them all on flood control."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until the next send slot is available."""
+        while True:
+            async with self._lock:
+                now = time.monotonic()
+                slot = max(now, self._next_slot, self._paused_until)
+                self._next_slot = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            # Slots handed out before a pause must not fire inside it
+            if time.monotonic() >= self._paused_until:
+                return
+
+    def pause(self, seconds):
+        """Hold every sender, including those already waiting, after Telegram asks us to slow down."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._next_slot = max(self._next_slot, self._paused_until)
+
+
+# Telegram's limit is per bot, not per instance. claim_job lets only one
+# broadcast job run across the cluster, so this process-wide limiter is the
+# bot's whole broadcast rate. It is also shared by any in-process Broadcaster.
+send_limiter = RateLimiter(BROADCAST_RATE)
+
+
+class Broadcaster:
+    """Send a stored broadcast to every buyer, checkpointing progress in the database."""
+
+    def __init__(self, bot, db, limiter=send_limiter, batch_size=BROADCAST_BATCH_SIZE, max_retries=3):
+        self.bot = bot
+        self.db = db
+        self.batch_size = batch_size
+        self.max_retries = max_retries
+        self.limiter = limiter
+
+    async def run(self, broadcast_id):
+        """Deliver a broadcast, resuming from its last checkpoint. Returns delivery stats."""
+        broadcast = self.db.get_broadcast(broadcast_id)
+        if not broadcast:
+            raise ValueError(f"Broadcast {broadcast_id} not found")
+
+        last_user_id = broadcast['last_user_id'] or 0
+        counts = {
+            'sent': broadcast['sent'] or 0,
+            'failed': broadcast['failed'] or 0,
+            'blocked': broadcast['blocked'] or 0,
+        }
+        attempted = 0
+        started = time.monotonic()
+
+        logger.info(f"Broadcast {broadcast_id} starting after user_id {last_user_id}")
+
+        while True:
+            user_ids = self.db.get_buyer_ids_after(last_user_id, self.batch_size)
+            if not user_ids:
+                break
+
+            results = await asyncio.gather(*(self._send(user_id, broadcast) for user_id in user_ids))
+            for result in results:
+                counts[result] += 1
+            attempted += len(user_ids)
+            last_user_id = user_ids[-1]
+
+            # A crash re-sends at most the batch in flight
+            self.db.checkpoint_broadcast(
+                broadcast_id, last_user_id, counts['sent'], counts['failed'], counts['blocked']
+            )
+            elapsed = time.monotonic() - started
+            logger.info(
+                f"Broadcast {broadcast_id}: {attempted} attempted this run "
+                f"({attempted / elapsed:.1f} msg/s), {counts['sent']} sent, "
+                f"{counts['failed']} failed, {counts['blocked']} blocked"
+            )
+
+        self.db.finish_broadcast(broadcast_id)
+        elapsed = time.monotonic() - started
+        return {
+            **counts,
+            'attempted': attempted,
+            'elapsed': elapsed,
+            'rate': attempted / elapsed if elapsed > 0 else 0.0,
+        }
+
+    async def _send(self, user_id, broadcast):
+        """Send one message, honouring retry-after. Returns 'sent', 'failed' or 'blocked'."""
+        for attempt in range(self.max_retries):
+            await self.limiter.acquire()
+            try:
+                if broadcast.get('photo_id'):
+                    await self.bot.send_photo(
+                        chat_id=user_id,
+                        photo=broadcast['photo_id'],
+                        caption=broadcast['message'],
+                        parse_mode='Markdown'
+                    )
+                else:
+                    await self.bot.send_message(
+                        chat_id=user_id,
+                        text=broadcast['message'],
+                        parse_mode='Markdown'
+                    )
+                return 'sent'
+            except telegram.error.RetryAfter as e:
+                logger.warning(f"Flood control hit, pausing broadcast for {e.retry_after}s")
+                self.limiter.pause(e.retry_after)
+            except telegram.error.Forbidden:
+                # User blocked the bot or deleted their account
+                return 'blocked'
+            except telegram.error.BadRequest as e:
+                logger.error(f"Broadcast to {user_id} rejected: {e}")
+                return 'failed'
+            except telegram.error.NetworkError as e:
+                logger.error(f"Network error broadcasting to {user_id}: {e}")
+                await asyncio.sleep(1)
+        return 'failed'
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import time
+
+from config import CATALOG_CACHE_TTL
+from database import CATALOG_CHANNEL
+
+logger = logging.getLogger(__name__)
+
+
+class Catalog:
+    """Per-process product cache kept fresh by Postgres LISTEN/NOTIFY.
+
+    Every product change bumps the catalog version and NOTIFYs it. Each
+    instance listens and marks its copy stale as soon as it hears of a newer
+    version, so caching stays correct across instances. The TTL is only a
+    safety net for notifications missed while the listener reconnects.
+    """
+
+    def __init__(self, db, ttl=CATALOG_CACHE_TTL):
+        self.db = db
+        self.ttl = ttl
+        self.version = -1
+        self.latest_version = 0
+        self._products = []
+        self._by_id = {}
+        self._loaded_at = 0.0
+
+    def is_fresh(self):
+        return self.version >= self.latest_version and time.monotonic() - self._loaded_at < self.ttl
+
+    def invalidate(self, version=None):
+        """Mark the cache stale, up to `version` if known."""
+        if version is None:
+            self._loaded_at = 0.0
+        else:
+            self.latest_version = max(self.latest_version, version)
+
+    def get_products(self):
+        """Get all products, newest first."""
+        if not self.is_fresh():
+            version, products = self.db.get_catalog()
+            self._products = products
+            self._by_id = {product['id']: product for product in products}
+            self.version = version
+            self.latest_version = max(self.latest_version, version)
+            self._loaded_at = time.monotonic()
+            logger.info(f"Catalog reloaded at version {version} ({len(products)} products)")
+        return self._products
+
+    def get_product(self, product_id):
+        """Get a product by ID, or None."""
+        self.get_products()
+        return self._by_id.get(product_id)
+
+    async def listen(self):
+        """Invalidate the cache on every catalog notification, reconnecting on failure."""
+        loop = asyncio.get_running_loop()
+        while True:
+            conn = None
+            try:
+                conn = await asyncio.to_thread(
+                    self.db.get_connection,
+                    keepalives=1, keepalives_idle=30, keepalives_interval=5, keepalives_count=3
+                )
+                conn.autocommit = True
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {CATALOG_CHANNEL}")
+                # Changes made while we weren't listening were never heard
+                self.invalidate()
+                logger.info(f"Listening for catalog changes on {CATALOG_CHANNEL}")
+
+                readable = asyncio.Event()
+                loop.add_reader(conn.fileno(), readable.set)
+                try:
+                    while True:
+                        await readable.wait()
+                        readable.clear()
+                        conn.poll()
+                        while conn.notifies:
+                            notify = conn.notifies.pop(0)
+                            self.invalidate(int(notify.payload))
+                finally:
+                    loop.remove_reader(conn.fileno())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Catalog listener error: {e}")
+                await asyncio.sleep(5)
+            finally:
+                if conn is not None:
+                    conn.close()
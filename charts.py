@@ -0,0 +1,31 @@
+import io
+
+# matplotlib is optional; charts are skipped when it isn't installed
+try:
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+except ImportError:
+    plt = None
+
+
+def charts_available():
+    return plt is not None
+
+
+def render_revenue_chart(labels, revenues, title):
+    """Render a revenue bar chart and return it as PNG bytes."""
+    figure, axes = plt.subplots(figsize=(10, 5))
+    try:
+        axes.bar(range(len(labels)), revenues, color='#9945FF')
+        axes.set_xticks(range(len(labels)))
+        axes.set_xticklabels(labels, rotation=45, ha='right', fontsize=8)
+        axes.set_ylabel('SOL')
+        axes.set_title(title)
+        figure.tight_layout()
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format='png', dpi=100)
+        return buffer.getvalue()
+    finally:
+        plt.close(figure)
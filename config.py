@@ -1,4 +1,5 @@
 import os
+import socket
 from dotenv import load_dotenv
 
 # Load environment variables
@@ -25,3 +26,45 @@ DEFAULT_PRODUCT = {
     "price": 0.1,
     "download_link": os.getenv('DEFAULT_PRODUCT_LINK', '')
 } 
+
+
+# Broadcast Configuration
+BROADCAST_RATE = 25  # messages per second, kept under Telegram's ~30/s global limit
+BROADCAST_BATCH_SIZE = 500  # buyers sent per checkpoint
+
+# Logging Configuration
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_MAX_BYTES = 10 * 1024 * 1024  # rotate bot.log at 10 MB
+LOG_BACKUP_COUNT = 5
+LOG_RATE_LIMIT = 10  # warnings/errors allowed per call site per window
+LOG_RATE_WINDOW = 60  # seconds
+
+# Multi-instance Configuration
+NODE_ID = os.getenv('DYNO') or f"{socket.gethostname()}-{os.getpid()}"
+POLLER_LOCK_KEY = 727001  # Postgres advisory lock held by the instance that polls Telegram
+HEARTBEAT_INTERVAL = 5  # seconds between leader checks and node heartbeats
+JOB_LEASE_SECONDS = 60  # a job is reclaimed by another instance if its lease isn't renewed
+JOB_POLL_INTERVAL = 1  # seconds between queue checks when idle
+JOB_CONCURRENCY = 4  # jobs run at once per instance
+JOB_MAX_ATTEMPTS = 3
+
+# Signature Submission Limits
+SIGNATURE_USER_BURST = 3  # attempts a user can make back to back
+SIGNATURE_USER_RATE = 1 / 20  # attempts per second refilled per user
+SIGNATURE_GLOBAL_BURST = 20  # verifications queued back to back across all users
+SIGNATURE_GLOBAL_RATE = 2  # verifications per second across all users
+RATE_LIMIT_MAX_USERS = 10000  # users tracked before the least recent is forgotten
+
+# Inline Search Configuration
+INLINE_RESULTS_LIMIT = 20  # results per page of an inline query
+INLINE_CACHE_TIME = 60  # seconds Telegram may cache inline results
+
+# Catalog Cache Configuration
+CATALOG_CACHE_TTL = 300  # seconds; fallback in case a change notification is missed
+
+# Analytics Configuration
+ROLLUP_INTERVAL = 300  # seconds between sales rollup runs
+ROLLUP_BATCH_SIZE = 5000  # purchases rolled up per transaction
+REVENUE_DEFAULT_COUNTS = {'hour': 24, 'day': 14, 'week': 8, 'product': 30}
+REVENUE_MAX_COUNT = 366
@@ -0,0 +1,361 @@
+import asyncio
+import logging
+import multiprocessing
+import queue
+import time
+import uuid
+
+from config import (
+    NODE_ID, POLLER_LOCK_KEY, HEARTBEAT_INTERVAL,
+    JOB_LEASE_SECONDS, JOB_POLL_INTERVAL, JOB_CONCURRENCY, JOB_MAX_ATTEMPTS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class Coordinator:
+    """Elect one poller across all instances with a Postgres advisory lock.
+
+    The lock is session-level and held on a dedicated connection, so if the
+    poller dies its connection closes (or its server-side keepalives time
+    out), Postgres releases the lock and the next instance to check takes
+    over. Every instance also heartbeats into the nodes table so admins can
+    see who is running.
+    """
+
+    def __init__(self, db, node_id=NODE_ID, lock_key=POLLER_LOCK_KEY, interval=HEARTBEAT_INTERVAL):
+        self.db = db
+        self.node_id = node_id
+        self.lock_key = lock_key
+        self.interval = interval
+        self.is_poller = False
+        self._lock_conn = None
+
+    def try_acquire(self):
+        """Try to take the poller lock without waiting."""
+        try:
+            if self._lock_conn is None:
+                # Server-side keepalives make Postgres drop the session, and with
+                # it the lock, within seconds if the poller's host vanishes without
+                # closing the socket. Client-side keepalives let us notice the
+                # same failure from this end.
+                self._lock_conn = self.db.get_connection(
+                    keepalives=1, keepalives_idle=5, keepalives_interval=2, keepalives_count=2,
+                    options='-c tcp_keepalives_idle=5 -c tcp_keepalives_interval=2 -c tcp_keepalives_count=2'
+                )
+                self._lock_conn.autocommit = True
+            with self._lock_conn.cursor() as cur:
+                cur.execute("SELECT pg_try_advisory_lock(%s)", (self.lock_key,))
+                return cur.fetchone()[0]
+        except Exception as e:
+            logger.error(f"Failed to acquire poller lock: {e}")
+            self._close_lock_conn()
+            return False
+
+    def still_holds_lock(self):
+        """Check the lock connection is alive. The lock lives exactly as long as it does."""
+        try:
+            with self._lock_conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            return True
+        except Exception as e:
+            logger.error(f"Lost poller lock connection: {e}")
+            self._close_lock_conn()
+            return False
+
+    def release(self):
+        """Give up the poller lock, e.g. on shutdown."""
+        if self._lock_conn is not None and self.is_poller:
+            try:
+                with self._lock_conn.cursor() as cur:
+                    cur.execute("SELECT pg_advisory_unlock(%s)", (self.lock_key,))
+            except Exception as e:
+                logger.error(f"Failed to release poller lock: {e}")
+        self.is_poller = False
+        self._close_lock_conn()
+
+    def _close_lock_conn(self):
+        if self._lock_conn is not None:
+            try:
+                self._lock_conn.close()
+            except Exception:
+                pass
+            self._lock_conn = None
+
+    async def _demote(self, on_demoted):
+        try:
+            await on_demoted()
+        except Exception as e:
+            logger.error(f"Node {self.node_id} failed to stop polling: {e}", exc_info=True)
+
+    async def run(self, on_elected, on_demoted):
+        """Check leadership and heartbeat forever, calling back on every change."""
+        while True:
+            if self.is_poller:
+                if not await asyncio.to_thread(self.still_holds_lock):
+                    self.is_poller = False
+                    logger.warning(f"Node {self.node_id} is no longer the poller")
+                    await self._demote(on_demoted)
+            elif await asyncio.to_thread(self.try_acquire):
+                self.is_poller = True
+                logger.info(f"Node {self.node_id} elected poller")
+                try:
+                    await on_elected()
+                except Exception as e:
+                    # Give the lock back so this node, or another one, retries on the next heartbeat
+                    logger.error(f"Node {self.node_id} failed to start polling: {e}", exc_info=True)
+                    await self._demote(on_demoted)
+                    await asyncio.to_thread(self.release)
+
+            try:
+                await asyncio.to_thread(self.db.heartbeat_node, self.node_id, self.is_poller)
+            except Exception as e:
+                logger.error(f"Node heartbeat failed: {e}")
+
+            await asyncio.sleep(self.interval)
+
+
+class JobWorker:
+    """Run jobs from the shared jobs table on every instance.
+
+    Each claimed job is leased to this node and the lease is renewed while the
+    handler runs. If the node dies the lease lapses and another node picks the
+    job up, so handlers must be safe to run again.
+    """
+
+    def __init__(self, db, handlers, node_id=NODE_ID, concurrency=JOB_CONCURRENCY,
+                 lease_seconds=JOB_LEASE_SECONDS, poll_interval=JOB_POLL_INTERVAL,
+                 max_attempts=JOB_MAX_ATTEMPTS):
+        self.db = db
+        self.handlers = handlers
+        self.node_id = node_id
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._slots = asyncio.Semaphore(concurrency)
+        self._running = set()
+
+    async def run(self):
+        """Claim and run jobs until cancelled."""
+        try:
+            while True:
+                await self._slots.acquire()
+                try:
+                    job = await asyncio.to_thread(
+                        self.db.claim_job, self.node_id, self.lease_seconds, self.handlers
+                    )
+                except Exception as e:
+                    logger.error(f"Failed to claim job: {e}")
+                    job = None
+
+                if job is None:
+                    self._slots.release()
+                    await asyncio.sleep(self.poll_interval)
+                    continue
+
+                task = asyncio.create_task(self._run_job(job))
+                self._running.add(task)
+                task.add_done_callback(self._running.discard)
+        finally:
+            for task in list(self._running):
+                task.cancel()
+
+    async def _run_job(self, job):
+        heartbeat = asyncio.create_task(self._renew_lease(job['id']))
+        started = time.monotonic()
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                raise ValueError(f"No handler for job kind {job['kind']!r}")
+
+            await handler(job['payload'])
+            await asyncio.to_thread(self.db.complete_job, job['id'])
+            logger.info(f"Job {job['id']} ({job['kind']}) done in {time.monotonic() - started:.2f}s")
+        except asyncio.CancelledError:
+            # Shutting down: leave the lease to lapse so another node resumes the job
+            raise
+        except Exception as e:
+            logger.error(f"Job {job['id']} ({job['kind']}) failed: {e}", exc_info=True)
+            retry_in = 2 ** job['attempts'] if job['attempts'] < self.max_attempts else None
+            await asyncio.to_thread(self.db.fail_job, job['id'], str(e), retry_in)
+        finally:
+            heartbeat.cancel()
+            self._slots.release()
+
+    async def _renew_lease(self, job_id):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                renewed = await asyncio.to_thread(
+                    self.db.extend_job_lease, job_id, self.node_id, self.lease_seconds
+                )
+                if not renewed:
+                    logger.warning(f"Lease on job {job_id} was taken over by another node")
+                    return
+            except Exception as e:
+                logger.error(f"Failed to renew lease on job {job_id}: {e}")
+
+
+def _simulate_node(node_id, events, interval):
+    """Run one coordinator until killed, reporting each leadership change to `events`."""
+    from database import Database
+
+    async def report(event):
+        events.put((node_id, event, time.time()))
+
+    async def node():
+        db = Database()
+        db.init_db()
+        coordinator = Coordinator(db, node_id=node_id, interval=interval)
+        await coordinator.run(lambda: report('elected'), lambda: report('demoted'))
+
+    asyncio.run(node())
+
+
+def _simulate_worker(node_id, events, kind, lease_seconds, block):
+    """Run one job worker until killed. With `block` set, claimed jobs never finish."""
+    from database import Database
+
+    async def handler(payload):
+        events.put((node_id, 'claimed', time.time()))
+        if block:
+            await asyncio.Event().wait()
+
+    async def node():
+        worker = JobWorker(
+            Database(), {kind: handler}, node_id=node_id,
+            lease_seconds=lease_seconds, poll_interval=0.2
+        )
+        await worker.run()
+
+    asyncio.run(node())
+
+
+def _next_event(events, timeout):
+    try:
+        return events.get(timeout=timeout)
+    except queue.Empty:
+        return None
+
+
+def _check_election(count, interval):
+    """Kill each elected poller in turn and check the next takeover.
+
+    Fails if two nodes ever hold the lock at once, or if a takeover takes
+    longer than two heartbeats.
+    """
+    events = multiprocessing.Queue()
+    processes = {
+        f"sim-{i}": multiprocessing.Process(target=_simulate_node, args=(f"sim-{i}", events, interval))
+        for i in range(count)
+    }
+    for process in processes.values():
+        process.start()
+
+    errors = []
+    intervals = []
+    killed_at = None
+    try:
+        event = _next_event(events, timeout=10 + interval)
+        if event is None:
+            errors.append("No node was elected")
+        while event is not None:
+            node_id, kind, at = event
+            if kind != 'elected':
+                errors.append(f"{node_id} {kind} unexpectedly")
+                break
+            if killed_at is None:
+                print(f"{node_id} elected", flush=True)
+            else:
+                failover = at - killed_at
+                print(f"{node_id} elected {failover:.2f}s after the poller was killed", flush=True)
+                if failover > 2 * interval:
+                    errors.append(f"Failover to {node_id} took {failover:.2f}s (limit {2 * interval}s)")
+
+            # Nobody else may be elected while this poller is alive
+            extra = _next_event(events, timeout=3 * interval)
+            if extra is not None:
+                errors.append(f"{extra[0]} {extra[1]} while {node_id} held the lock")
+                break
+
+            killed_at = time.time()
+            intervals.append((node_id, at, killed_at))
+            processes.pop(node_id).kill()
+            if not processes:
+                break
+            event = _next_event(events, timeout=2 * interval + 5)
+            if event is None:
+                errors.append(f"No node took over after {node_id} was killed")
+    finally:
+        for process in processes.values():
+            process.kill()
+
+    for (_, _, ended), (node_id, started, _) in zip(intervals, intervals[1:]):
+        if started < ended:
+            errors.append(f"{node_id} was elected before the previous poller was killed")
+    return errors
+
+
+def _check_job_failover(lease_seconds):
+    """Kill a node mid-job and check another node finishes the job once the lease lapses."""
+    from database import Database
+
+    db = Database()
+    db.init_db()
+    # A kind of its own, so real workers and earlier runs never touch the job
+    kind = f"simulate_{uuid.uuid4().hex}"
+    job_id = db.enqueue_job(kind, {})
+    events = multiprocessing.Queue()
+    errors = []
+
+    first = multiprocessing.Process(
+        target=_simulate_worker, args=('sim-a', events, kind, lease_seconds, True)
+    )
+    second = multiprocessing.Process(
+        target=_simulate_worker, args=('sim-b', events, kind, lease_seconds, False)
+    )
+    try:
+        first.start()
+        event = _next_event(events, timeout=10)
+        if event is None:
+            return [f"sim-a never claimed job {job_id}"]
+        killed_at = time.time()
+        first.kill()
+        print(f"sim-a claimed job {job_id} and was killed", flush=True)
+
+        second.start()
+        event = _next_event(events, timeout=lease_seconds + 10)
+        if event is None:
+            return [f"Job {job_id} was not picked up after sim-a died"]
+        print(f"{event[0]} picked up job {job_id} {event[2] - killed_at:.2f}s later", flush=True)
+
+        deadline = time.time() + 5
+        job = db.get_job(job_id)
+        while job['status'] != 'done' and time.time() < deadline:
+            time.sleep(0.2)
+            job = db.get_job(job_id)
+        if job['status'] != 'done' or job['locked_by'] != 'sim-b':
+            errors.append(f"Job {job_id} ended {job['status']} on {job['locked_by']}, expected done on sim-b")
+    finally:
+        for process in (first, second):
+            if process.is_alive():
+                process.kill()
+    return errors
+
+
+if __name__ == '__main__':
+    # Local multi-process check of election and job failover against DATABASE_URL:
+    #   python coordination.py [nodes]
+    # Exits non-zero if two pollers overlap, a takeover is slow, or a job
+    # left by a killed node isn't finished by another.
+    import sys
+
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    errors = _check_election(count, interval=1) + _check_job_failover(lease_seconds=3)
+    for error in errors:
+        print(f"FAIL: {error}", flush=True)
+    print("FAILED" if errors else "OK", flush=True)
+    sys.exit(1 if errors else 0)
@@ -1,9 +1,32 @@
 import os
+import logging
 import psycopg2
-from psycopg2.extras import DictCursor
+from psycopg2.extras import DictCursor, execute_values
 import json
 from urllib.parse import urlparse
 
+logger = logging.getLogger(__name__)
+
+# Bump whenever the DDL in create_schema changes
+SCHEMA_VERSION = 5
+
+# Advisory lock serializing schema migrations between instances booting together
+SCHEMA_LOCK_KEY = 727002
+
+# Advisory lock serializing job claims, so no two nodes start a broadcast at once
+JOB_CLAIM_LOCK_KEY = 727003
+
+# Channel notified with the new catalog version whenever products change
+CATALOG_CHANNEL = 'catalog_changed'
+
+# Rollup table, period expression and window start for each analytics period.
+# The window covers the current period plus `count - 1` before it.
+REVENUE_PERIODS = {
+    'hour': ("sales_hourly", "bucket", "date_trunc('hour', CURRENT_TIMESTAMP) - (%s - 1) * INTERVAL '1 hour'"),
+    'day': ("sales_daily", "bucket", "date_trunc('day', CURRENT_TIMESTAMP) - (%s - 1) * INTERVAL '1 day'"),
+    'week': ("sales_daily", "date_trunc('week', bucket)", "date_trunc('week', CURRENT_TIMESTAMP) - (%s - 1) * INTERVAL '1 week'"),
+}
+
 class Database:
     def __init__(self):
         # Get database URL from environment variable
@@ -16,61 +39,207 @@ class Database:
         if not url.scheme or not url.netloc:
             raise ValueError("Invalid DATABASE_URL format")
         
-        # Initialize database
-        self.init_db()
+        # Tables are created by init_db(), which the bot runs during startup
 
-    def get_connection(self):
+    def get_connection(self, **kwargs):
         """Create a database connection."""
         try:
-            return psycopg2.connect(self.db_url, sslmode='require')
+            return psycopg2.connect(self.db_url, sslmode='require', **kwargs)
         except Exception as e:
             logger.error(f"Database connection error: {e}")
             raise
 
     def init_db(self):
-        """Initialize database tables."""
+        """Initialize database tables, skipping the DDL when the schema is current."""
         try:
             with self.get_connection() as conn:
                 with conn.cursor() as cur:
-                    # Create products table
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS products (
-                            id SERIAL PRIMARY KEY,
-                            title TEXT NOT NULL,
-                            description TEXT,
-                            price FLOAT NOT NULL,
-                            photo_id TEXT,
-                            download_content TEXT,
-                            is_file BOOLEAN DEFAULT FALSE,
-                            file_name TEXT,
-                            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                        )
-                    """)
+                    version = self.get_schema_version(cur)
+                    if version >= SCHEMA_VERSION:
+                        logger.info(f"Database schema is at version {version}, skipping DDL")
+                        return
                     
-                    # Create buyers table
-                    cur.execute("""
-                        CREATE TABLE IF NOT EXISTS buyers (
-                            id SERIAL PRIMARY KEY,
-                            user_id BIGINT NOT NULL,
-                            username TEXT,
-                            product_id INTEGER REFERENCES products(id),
-                            purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                            transaction_signature TEXT UNIQUE
-                        )
-                    """)
+                    # Concurrent DDL can fail on catalog conflicts, so migrate one
+                    # instance at a time and re-check once we hold the lock
+                    cur.execute("SELECT pg_advisory_xact_lock(%s)", (SCHEMA_LOCK_KEY,))
+                    version = self.get_schema_version(cur)
+                    if version >= SCHEMA_VERSION:
+                        logger.info(f"Database schema was migrated to version {version} by another instance")
+                        conn.commit()
+                        return
                     
+                    logger.info(f"Migrating database schema from version {version} to {SCHEMA_VERSION}")
+                    self.create_schema(cur)
+                    cur.execute("DELETE FROM schema_version")
+                    cur.execute("INSERT INTO schema_version (version) VALUES (%s)", (SCHEMA_VERSION,))
                     conn.commit()
         except Exception as e:
             logger.error(f"Database initialization error: {e}")
             raise
 
+    def get_schema_version(self, cur):
+        """Get the recorded schema version, or 0 for a fresh database."""
+        cur.execute("SELECT to_regclass('schema_version')")
+        if cur.fetchone()[0] is None:
+            return 0
+        cur.execute("SELECT MAX(version) FROM schema_version")
+        return cur.fetchone()[0] or 0
+
+    def create_schema(self, cur):
+        """Create all tables and indexes. Every statement must be idempotent."""
+        # Create products table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS products (
+                id SERIAL PRIMARY KEY,
+                title TEXT NOT NULL,
+                description TEXT,
+                price FLOAT NOT NULL,
+                photo_id TEXT,
+                download_content TEXT,
+                is_file BOOLEAN DEFAULT FALSE,
+                file_name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Create buyers table
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS buyers (
+                id SERIAL PRIMARY KEY,
+                user_id BIGINT NOT NULL,
+                username TEXT,
+                product_id INTEGER REFERENCES products(id),
+                purchase_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                transaction_signature TEXT UNIQUE
+            )
+        """)
+        
+        # Index buyers by user so per-user lookups don't scan the table
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_buyers_user_id ON buyers (user_id)")
+        
+        # Create broadcasts table (progress checkpoint for resumable announcements)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS broadcasts (
+                id SERIAL PRIMARY KEY,
+                message TEXT NOT NULL,
+                photo_id TEXT,
+                admin_chat_id BIGINT,
+                last_user_id BIGINT DEFAULT 0,
+                sent INTEGER DEFAULT 0,
+                failed INTEGER DEFAULT 0,
+                blocked INTEGER DEFAULT 0,
+                status TEXT DEFAULT 'running',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        
+        # Create jobs table (shared work queue for every bot instance)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id SERIAL PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload JSONB NOT NULL,
+                status TEXT DEFAULT 'pending',
+                attempts INTEGER DEFAULT 0,
+                locked_by TEXT,
+                locked_until TIMESTAMP,
+                run_after TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                last_error TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                finished_at TIMESTAMP
+            )
+        """)
+        cur.execute("""
+            CREATE INDEX IF NOT EXISTS idx_jobs_claimable
+            ON jobs (run_after) WHERE status IN ('pending', 'running')
+        """)
+        
+        # Create nodes table (heartbeats of running bot instances)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS nodes (
+                node_id TEXT PRIMARY KEY,
+                is_poller BOOLEAN DEFAULT FALSE,
+                started_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                heartbeat_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        
+        # Full-text search over product titles and descriptions
+        cur.execute("""
+            ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS (
+                setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+                setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+            ) STORED
+        """)
+        cur.execute("CREATE INDEX IF NOT EXISTS idx_products_search ON products USING GIN (search_vector)")
+        
+        # Catalog version, bumped and NOTIFYed on every product change
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS catalog_version (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                version BIGINT NOT NULL
+            )
+        """)
+        cur.execute("INSERT INTO catalog_version (id, version) VALUES (1, 0) ON CONFLICT DO NOTHING")
+        cur.execute("ALTER TABLE products ADD COLUMN IF NOT EXISTS catalog_version BIGINT DEFAULT 0")
+        
+        # Sales rollups, filled incrementally from buyers by rollup_sales
+        for table in ('sales_hourly', 'sales_daily'):
+            cur.execute(f"""
+                CREATE TABLE IF NOT EXISTS {table} (
+                    bucket TIMESTAMP NOT NULL,
+                    product_id INTEGER NOT NULL,
+                    sales INTEGER NOT NULL DEFAULT 0,
+                    revenue FLOAT NOT NULL DEFAULT 0,
+                    PRIMARY KEY (bucket, product_id)
+                )
+            """)
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS rollup_watermark (
+                name TEXT PRIMARY KEY,
+                last_buyer_id INTEGER NOT NULL
+            )
+        """)
+        cur.execute("INSERT INTO rollup_watermark (name, last_buyer_id) VALUES ('sales', 0) ON CONFLICT DO NOTHING")
+        
+        # Create schema version marker
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS schema_version (
+                version INTEGER NOT NULL
+            )
+        """)
+
+    def bump_catalog_version(self, cur):
+        """Increment the catalog version and notify listeners when the transaction commits.
+
+        The row update is transactional (unlike a sequence), so a reader that
+        sees version N is guaranteed to also see every change up to N.
+        """
+        cur.execute("UPDATE catalog_version SET version = version + 1 WHERE id = 1 RETURNING version")
+        version = cur.fetchone()[0]
+        cur.execute("SELECT pg_notify(%s, %s)", (CATALOG_CHANNEL, str(version)))
+        return version
+
+    def get_catalog(self):
+        """Get the catalog version and all products, read consistently with each other."""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                # Read the version first: the products read after it are at least that new
+                cur.execute("SELECT version FROM catalog_version WHERE id = 1")
+                version = cur.fetchone()[0]
+                cur.execute("SELECT * FROM products ORDER BY created_at DESC")
+                return version, [dict(row) for row in cur.fetchall()]
+
     def save_product(self, product):
         """Save a product to the database."""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
+                version = self.bump_catalog_version(cur)
                 cur.execute("""
-                    INSERT INTO products (title, description, price, photo_id, download_content, is_file, file_name)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    INSERT INTO products (title, description, price, photo_id, download_content, is_file, file_name, catalog_version)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
                     RETURNING id
                 """, (
                     product['title'],
@@ -79,10 +248,52 @@ class Database:
                     product.get('photo_id'),
                     product.get('download_content'),
                     product.get('is_file', False),
-                    product.get('file_name')
+                    product.get('file_name'),
+                    version
                 ))
                 return cur.fetchone()[0]
 
+    def save_products(self, products, page_size=100):
+        """Save many products in one transaction, skipping titles that already exist.
+
+        Returns a tuple of (created product IDs, skipped titles).
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                titles = [product['title'] for product in products]
+                cur.execute("SELECT title FROM products WHERE title = ANY(%s)", (titles,))
+                seen = {row[0] for row in cur.fetchall()}
+
+                rows = []
+                skipped = []
+                for product in products:
+                    if product['title'] in seen:
+                        skipped.append(product['title'])
+                        continue
+                    seen.add(product['title'])
+                    rows.append((
+                        product['title'],
+                        product['description'],
+                        product['price'],
+                        product.get('photo_id'),
+                        product.get('download_content'),
+                        product.get('is_file', False),
+                        product.get('file_name')
+                    ))
+
+                created = []
+                if rows:
+                    # One version bump for the whole import
+                    version = self.bump_catalog_version(cur)
+                    rows = [row + (version,) for row in rows]
+                    created = execute_values(cur, """
+                        INSERT INTO products (title, description, price, photo_id, download_content, is_file, file_name, catalog_version)
+                        VALUES %s
+                        RETURNING id
+                    """, rows, page_size=page_size, fetch=True)
+                conn.commit()
+                return [row[0] for row in created], skipped
+
     def get_all_products(self):
         """Get all products from the database."""
         with self.get_connection() as conn:
@@ -90,22 +301,59 @@ class Database:
                 cur.execute("SELECT * FROM products ORDER BY created_at DESC")
                 return [dict(row) for row in cur.fetchall()]
 
-    def remove_product(self, product_title):
-        """Remove a product from the database."""
+    def search_products(self, terms, limit, offset=0):
+        """Search products by title and description, matching each term as a prefix.
+
+        With no terms, returns the newest products.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                if not terms:
+                    cur.execute("""
+                        SELECT id, title, description, price, photo_id
+                        FROM products
+                        ORDER BY created_at DESC
+                        LIMIT %s OFFSET %s
+                    """, (limit, offset))
+                else:
+                    tsquery = ' & '.join(f"{term}:*" for term in terms)
+                    cur.execute("""
+                        SELECT id, title, description, price, photo_id
+                        FROM products
+                        WHERE search_vector @@ to_tsquery('simple', %s)
+                        ORDER BY ts_rank(search_vector, to_tsquery('simple', %s)) DESC, created_at DESC
+                        LIMIT %s OFFSET %s
+                    """, (tsquery, tsquery, limit, offset))
+                return [dict(row) for row in cur.fetchall()]
+
+    def remove_product(self, product_id):
+        """Remove a product from the database. Returns its title, or None if it didn't exist."""
         with self.get_connection() as conn:
             with conn.cursor() as cur:
-                cur.execute("DELETE FROM products WHERE title = %s", (product_title,))
+                cur.execute("DELETE FROM products WHERE id = %s RETURNING title", (product_id,))
+                result = cur.fetchone()
+                if result:
+                    self.bump_catalog_version(cur)
                 conn.commit()
+                return result[0] if result else None
 
     def save_purchase(self, user_id, username, product_id, signature):
-        """Save a purchase record."""
+        """Save a purchase record, claiming its signature.
+
+        Returns False if the signature was already recorded, so concurrent
+        verifications of one payment can't both deliver.
+        """
         with self.get_connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
                     INSERT INTO buyers (user_id, username, product_id, transaction_signature)
                     VALUES (%s, %s, %s, %s)
+                    ON CONFLICT (transaction_signature) DO NOTHING
+                    RETURNING id
                 """, (user_id, username, product_id, signature))
+                claimed = cur.fetchone() is not None
                 conn.commit()
+                return claimed
 
     def get_total_sales(self):
         """Get total sales amount."""
@@ -130,6 +378,34 @@ class Database:
                 """)
                 return [dict(row) for row in cur.fetchall()]
 
+    def get_purchases_by_user(self, user_id):
+        """Get a user's purchases with the content needed to re-deliver them."""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT b.id, b.product_id, b.purchase_date,
+                           p.title, p.price, p.download_content, p.is_file, p.file_name
+                    FROM buyers b
+                    JOIN products p ON b.product_id = p.id
+                    WHERE b.user_id = %s
+                    ORDER BY b.purchase_date DESC
+                """, (user_id,))
+                return [dict(row) for row in cur.fetchall()]
+
+    def get_purchase(self, purchase_id, user_id):
+        """Get one purchase, only if it belongs to user_id."""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT b.id, b.product_id, b.purchase_date,
+                           p.title, p.price, p.download_content, p.is_file, p.file_name
+                    FROM buyers b
+                    JOIN products p ON b.product_id = p.id
+                    WHERE b.id = %s AND b.user_id = %s
+                """, (purchase_id, user_id))
+                result = cur.fetchone()
+                return dict(result) if result else None
+
     def is_signature_used(self, signature):
         """Check if a transaction signature has been used."""
         with self.get_connection() as conn:
@@ -143,4 +419,269 @@ class Database:
             with conn.cursor(cursor_factory=DictCursor) as cur:
                 cur.execute("SELECT * FROM products WHERE id = %s", (product_id,))
                 result = cur.fetchone()
-                return dict(result) if result else None 
\ No newline at end of file
+                return dict(result) if result else None 
+
+    def get_buyer_ids_after(self, last_user_id, limit):
+        """Get the next batch of distinct buyer user IDs greater than last_user_id."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT DISTINCT user_id
+                    FROM buyers
+                    WHERE user_id > %s
+                    ORDER BY user_id
+                    LIMIT %s
+                """, (last_user_id, limit))
+                return [row[0] for row in cur.fetchall()]
+
+    def count_buyer_ids(self):
+        """Get the number of distinct buyers."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(DISTINCT user_id) FROM buyers")
+                return cur.fetchone()[0]
+
+    def create_broadcast(self, message, photo_id=None, admin_chat_id=None):
+        """Create a broadcast record and return its ID."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO broadcasts (message, photo_id, admin_chat_id)
+                    VALUES (%s, %s, %s)
+                    RETURNING id
+                """, (message, photo_id, admin_chat_id))
+                return cur.fetchone()[0]
+
+    def get_broadcast(self, broadcast_id):
+        """Get a broadcast by its ID."""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT * FROM broadcasts WHERE id = %s", (broadcast_id,))
+                result = cur.fetchone()
+                return dict(result) if result else None
+
+    def checkpoint_broadcast(self, broadcast_id, last_user_id, sent, failed, blocked):
+        """Record broadcast progress so it can resume after a restart."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE broadcasts
+                    SET last_user_id = %s, sent = %s, failed = %s, blocked = %s
+                    WHERE id = %s
+                """, (last_user_id, sent, failed, blocked, broadcast_id))
+                conn.commit()
+
+    def finish_broadcast(self, broadcast_id, status='done'):
+        """Mark a broadcast as finished."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE broadcasts
+                    SET status = %s, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (status, broadcast_id))
+                conn.commit()
+
+    def enqueue_job(self, kind, payload, delay=0):
+        """Add a job to the shared queue and return its ID."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO jobs (kind, payload, run_after)
+                    VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                    RETURNING id
+                """, (kind, json.dumps(payload), delay))
+                return cur.fetchone()[0]
+
+    def get_job(self, job_id):
+        """Get a job by its ID."""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT * FROM jobs WHERE id = %s", (job_id,))
+                result = cur.fetchone()
+                return dict(result) if result else None
+
+    def claim_job(self, node_id, lease_seconds, kinds):
+        """Lease the oldest runnable job of one of `kinds` to node_id.
+
+        Jobs whose lease has expired (their node died) are claimable again.
+        Only kinds the caller has handlers for are claimed, so a node never
+        fails a job it doesn't know, e.g. during a rolling deploy.
+        Only one broadcast runs cluster-wide at a time, since Telegram's send
+        limit is per bot rather than per instance. Claims are serialized by an
+        advisory lock so two nodes can't both see no broadcast running.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("SELECT pg_advisory_xact_lock(%s)", (JOB_CLAIM_LOCK_KEY,))
+                cur.execute("""
+                    UPDATE jobs
+                    SET status = 'running',
+                        locked_by = %s,
+                        locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                        attempts = attempts + 1
+                    WHERE id = (
+                        SELECT id FROM jobs
+                        WHERE run_after <= CURRENT_TIMESTAMP
+                          AND kind = ANY(%s)
+                          AND (status = 'pending'
+                               OR (status = 'running' AND locked_until < CURRENT_TIMESTAMP))
+                          AND (kind <> 'broadcast' OR NOT EXISTS (
+                              SELECT 1 FROM jobs other
+                              WHERE other.kind = 'broadcast'
+                                AND other.status = 'running'
+                                AND other.locked_until >= CURRENT_TIMESTAMP
+                          ))
+                        ORDER BY id
+                        FOR UPDATE SKIP LOCKED
+                        LIMIT 1
+                    )
+                    RETURNING *
+                """, (node_id, lease_seconds, list(kinds)))
+                result = cur.fetchone()
+                conn.commit()
+                return dict(result) if result else None
+
+    def extend_job_lease(self, job_id, node_id, lease_seconds):
+        """Extend a running job's lease. Returns False if another node took it over."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE jobs
+                    SET locked_until = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                    WHERE id = %s AND locked_by = %s AND status = 'running'
+                """, (lease_seconds, job_id, node_id))
+                conn.commit()
+                return cur.rowcount == 1
+
+    def complete_job(self, job_id):
+        """Mark a job as done."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    UPDATE jobs
+                    SET status = 'done', locked_until = NULL, finished_at = CURRENT_TIMESTAMP
+                    WHERE id = %s
+                """, (job_id,))
+                conn.commit()
+
+    def fail_job(self, job_id, error, retry_in=None):
+        """Record a job failure, rescheduling it if retry_in seconds is given."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                if retry_in is not None:
+                    cur.execute("""
+                        UPDATE jobs
+                        SET status = 'pending', locked_by = NULL, locked_until = NULL, last_error = %s,
+                            run_after = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+                        WHERE id = %s
+                    """, (error, retry_in, job_id))
+                else:
+                    cur.execute("""
+                        UPDATE jobs
+                        SET status = 'failed', locked_until = NULL, last_error = %s,
+                            finished_at = CURRENT_TIMESTAMP
+                        WHERE id = %s
+                    """, (error, job_id))
+                conn.commit()
+
+    def heartbeat_node(self, node_id, is_poller):
+        """Record that a bot instance is alive and whether it is the poller."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO nodes (node_id, is_poller)
+                    VALUES (%s, %s)
+                    ON CONFLICT (node_id) DO UPDATE
+                    SET is_poller = EXCLUDED.is_poller, heartbeat_at = CURRENT_TIMESTAMP
+                """, (node_id, is_poller))
+                conn.commit()
+
+    def get_active_nodes(self, within_seconds):
+        """Get bot instances that sent a heartbeat recently."""
+        with self.get_connection() as conn:
+            with conn.cursor(cursor_factory=DictCursor) as cur:
+                cur.execute("""
+                    SELECT * FROM nodes
+                    WHERE heartbeat_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                    ORDER BY started_at
+                """, (within_seconds,))
+                return [dict(row) for row in cur.fetchall()]
+
+    def remove_node(self, node_id):
+        """Remove a bot instance's heartbeat on clean shutdown."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM nodes WHERE node_id = %s", (node_id,))
+                conn.commit()
+
+    def rollup_sales(self, batch_size, grace_seconds=60):
+        """Add buyers rows past the watermark to the hourly and daily rollups.
+
+        Rows younger than grace_seconds are left for the next run so purchases
+        still committing with a lower id aren't skipped. Returns the number of
+        purchases rolled up.
+        """
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                # Row lock serializes rollups when several instances run the job
+                cur.execute("SELECT last_buyer_id FROM rollup_watermark WHERE name = 'sales' FOR UPDATE")
+                low = cur.fetchone()[0]
+
+                cur.execute("""
+                    SELECT MAX(id), COUNT(*) FROM (
+                        SELECT id FROM buyers
+                        WHERE id > %s AND purchase_date < CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+                        ORDER BY id
+                        LIMIT %s
+                    ) batch
+                """, (low, grace_seconds, batch_size))
+                high, count = cur.fetchone()
+                if not count:
+                    conn.commit()
+                    return 0
+
+                for table, unit in (('sales_hourly', 'hour'), ('sales_daily', 'day')):
+                    cur.execute(f"""
+                        INSERT INTO {table} (bucket, product_id, sales, revenue)
+                        SELECT date_trunc('{unit}', b.purchase_date), b.product_id, COUNT(*), SUM(p.price)
+                        FROM buyers b
+                        JOIN products p ON b.product_id = p.id
+                        WHERE b.id > %s AND b.id <= %s
+                        GROUP BY 1, 2
+                        ON CONFLICT (bucket, product_id) DO UPDATE
+                        SET sales = {table}.sales + EXCLUDED.sales,
+                            revenue = {table}.revenue + EXCLUDED.revenue
+                    """, (low, high))
+
+                cur.execute("UPDATE rollup_watermark SET last_buyer_id = %s WHERE name = 'sales'", (high,))
+                conn.commit()
+                return count
+
+    def get_revenue(self, period, count):
+        """Get (period start, sales, revenue) rows for the last `count` hours, days or weeks."""
+        table, bucket, start = REVENUE_PERIODS[period]
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"""
+                    SELECT {bucket} AS period, SUM(sales), SUM(revenue)
+                    FROM {table}
+                    WHERE bucket >= {start}
+                    GROUP BY period
+                    ORDER BY period
+                """, (count,))
+                return cur.fetchall()
+
+    def get_revenue_by_product(self, days):
+        """Get (product title, sales, revenue) rows for the last `days` days, best sellers first."""
+        with self.get_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT COALESCE(p.title, 'Removed product #' || s.product_id), SUM(s.sales), SUM(s.revenue)
+                    FROM sales_daily s
+                    LEFT JOIN products p ON s.product_id = p.id
+                    WHERE s.bucket >= date_trunc('day', CURRENT_TIMESTAMP) - (%s - 1) * INTERVAL '1 day'
+                    GROUP BY s.product_id, p.title
+                    ORDER BY 3 DESC
+                """, (days,))
+                return cur.fetchall()
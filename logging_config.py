@@ -0,0 +1,129 @@
+import atexit
+import contextvars
+import json
+import logging
+import queue
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+
+from config import LOG_FILE, LOG_LEVEL, LOG_MAX_BYTES, LOG_BACKUP_COUNT, LOG_RATE_LIMIT, LOG_RATE_WINDOW
+
+# ID of the Telegram update currently being handled, attached to every record
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+CONSOLE_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+
+class JSONFormatter(logging.Formatter):
+    """Format records as one JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        if getattr(record, 'correlation_id', None) is not None:
+            entry['update_id'] = record.correlation_id
+        if getattr(record, 'suppressed', 0):
+            entry['suppressed'] = record.suppressed
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class BackgroundQueueHandler(QueueHandler):
+    """Enqueue records as-is so message and traceback formatting happen on the writer thread."""
+
+    def prepare(self, record):
+        return record
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamp records with the current update ID before they leave the handler's task."""
+
+    def filter(self, record):
+        record.correlation_id = correlation_id.get()
+        return True
+
+
+class RateLimitFilter(logging.Filter):
+    """Let through at most `limit` copies of a warning every `window` seconds.
+
+    A warning is identified by its call site, message and exception type, so
+    distinct errors funnelled through one handler (error_handler, JobWorker)
+    are limited separately. Suppressed records are counted and the count is
+    attached to the next matching record that gets through. Keys live in an
+    LRU of `max_keys` so varied messages can't grow it without bound.
+    """
+
+    def __init__(self, limit, window, max_keys=1000):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.max_keys = max_keys
+        self._sites = OrderedDict()
+
+    def filter(self, record):
+        if record.levelno < logging.WARNING:
+            return True
+
+        exc_type = record.exc_info[0] if record.exc_info else None
+        key = (record.pathname, record.lineno, str(record.msg), exc_type)
+        now = time.monotonic()
+        started, count, suppressed = self._sites.get(key, (now, 0, 0))
+        if now - started >= self.window:
+            started, count = now, 0
+
+        if count >= self.limit:
+            self._remember(key, (started, count, suppressed + 1))
+            return False
+
+        record.suppressed = suppressed
+        self._remember(key, (started, count + 1, 0))
+        return True
+
+    def _remember(self, key, state):
+        self._sites[key] = state
+        self._sites.move_to_end(key)
+        if len(self._sites) > self.max_keys:
+            self._sites.popitem(last=False)
+
+
+def setup_logging():
+    """Route all logging through a queue drained by a background writer thread.
+
+    Handlers only enqueue records, so formatting and disk I/O never run on
+    the event loop. The file log is JSON and rotates by size.
+    """
+    log_queue = queue.SimpleQueue()
+
+    queue_handler = BackgroundQueueHandler(log_queue)
+    queue_handler.addFilter(CorrelationFilter())
+    queue_handler.addFilter(RateLimitFilter(LOG_RATE_LIMIT, LOG_RATE_WINDOW))
+
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(CONSOLE_FORMAT))
+
+    file_handler = RotatingFileHandler(
+        LOG_FILE,
+        maxBytes=LOG_MAX_BYTES,
+        backupCount=LOG_BACKUP_COUNT,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(JSONFormatter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    # httpx logs every Telegram poll at INFO
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, console_handler, file_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
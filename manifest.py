@@ -0,0 +1,129 @@
+import csv
+import io
+import json
+import math
+
+
+class ManifestError(ValueError):
+    """Raised when a product manifest can't be imported."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__("; ".join(errors))
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or '').strip().lower() in ('1', 'true', 'yes', 'y')
+
+
+def _parse_text(value):
+    """Normalise a text cell to a stripped string or None.
+
+    JSON cells can hold objects, lists or booleans that the database can't
+    store as text, so only strings and numbers are accepted.
+    """
+    if value is None:
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        raise ValueError
+    return str(value).strip() or None
+
+
+def _read_rows(data, file_name):
+    """Decode a CSV or JSON manifest into a list of row dicts."""
+    try:
+        text = data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        raise ManifestError(["Manifest must be UTF-8 encoded"])
+
+    if (file_name or '').lower().endswith('.json') or text.lstrip().startswith(('[', '{')):
+        try:
+            rows = json.loads(text)
+        except json.JSONDecodeError as e:
+            raise ManifestError([f"Invalid JSON: {e}"])
+        # Accept either a bare list or {"products": [...]}
+        if isinstance(rows, dict):
+            rows = rows.get('products')
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ManifestError(["JSON manifest must be a list of product objects"])
+        return rows
+
+    return list(csv.DictReader(io.StringIO(text)))
+
+
+def parse_manifest(data, file_name=None):
+    """Parse and validate every row of a product manifest.
+
+    Returns a list of product dicts ready for Database.save_products. All rows
+    are checked before anything is returned, so a single bad row rejects the
+    whole manifest with ManifestError listing every problem found.
+    """
+    rows = _read_rows(data, file_name)
+    if not rows:
+        raise ManifestError(["Manifest contains no products"])
+
+    products = []
+    errors = []
+    for line, row in enumerate(rows, start=1):
+        row = {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+
+        try:
+            title = _parse_text(row.get('title'))
+        except ValueError:
+            errors.append(f"Row {line}: invalid title {row.get('title')!r}")
+            continue
+        if not title:
+            errors.append(f"Row {line}: missing title")
+            continue
+
+        # bool is an int subclass, so JSON true would otherwise become 1.0
+        raw_price = row.get('price')
+        try:
+            if isinstance(raw_price, bool):
+                raise ValueError
+            price = float(raw_price)
+        except (TypeError, ValueError):
+            errors.append(f"Row {line} ({title}): invalid price {raw_price!r}")
+            continue
+        if not math.isfinite(price):
+            errors.append(f"Row {line} ({title}): invalid price {raw_price!r}")
+            continue
+        if price <= 0:
+            errors.append(f"Row {line} ({title}): price must be positive")
+            continue
+
+        # Every bad field in the row is reported, not just the first
+        errors_before = len(errors)
+        fields = {}
+        for field, value in (
+            ('description', row.get('description')),
+            ('photo_id', row.get('photo_id')),
+            # download_link is accepted as an alias to match DEFAULT_PRODUCT
+            ('download_content', row.get('download_content') or row.get('download_link')),
+            ('file_name', row.get('file_name')),
+        ):
+            try:
+                fields[field] = _parse_text(value)
+            except ValueError:
+                errors.append(f"Row {line} ({title}): invalid {field} {value!r}")
+        is_file = row.get('is_file')
+        if not isinstance(is_file, (str, int, float, type(None))):
+            errors.append(f"Row {line} ({title}): invalid is_file {is_file!r}")
+        if len(errors) > errors_before:
+            continue
+
+        products.append({
+            'title': title,
+            'description': fields['description'] or '',
+            'price': price,
+            'photo_id': fields['photo_id'],
+            'download_content': fields['download_content'],
+            'is_file': _parse_bool(is_file),
+            'file_name': fields['file_name'],
+        })
+
+    if errors:
+        raise ManifestError(errors)
+    return products
@@ -0,0 +1,68 @@
+import time
+from collections import OrderedDict
+
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+BASE58_INDEX = {char: index for index, char in enumerate(BASE58_ALPHABET)}
+
+# A Solana signature is 64 bytes, which is 87 or 88 base58 characters
+# (fewer only with leading zero bytes)
+SIGNATURE_BYTES = 64
+SIGNATURE_MAX_LENGTH = 88
+
+
+def is_valid_signature(text):
+    """Check that text decodes as a 64-byte base58 Solana signature, without any I/O."""
+    if not text or len(text) > SIGNATURE_MAX_LENGTH:
+        return False
+
+    value = 0
+    for char in text:
+        digit = BASE58_INDEX.get(char)
+        if digit is None:
+            return False
+        value = value * 58 + digit
+
+    leading_zeros = len(text) - len(text.lstrip('1'))
+    return leading_zeros + (value.bit_length() + 7) // 8 == SIGNATURE_BYTES
+
+
+class TokenBucket:
+    """Allow bursts of `capacity` events, refilled at `rate` tokens per second."""
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def consume(self):
+        """Take a token. Returns 0 if allowed, otherwise seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class KeyedRateLimiter:
+    """One token bucket per key, kept in an LRU so memory stays bounded."""
+
+    def __init__(self, capacity, rate, max_keys):
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+
+    def consume(self, key):
+        """Take a token for key. Returns 0 if allowed, otherwise seconds to wait."""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.capacity, self.rate)
+            # Evicting an idle key only forgets that it was throttled
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+        return bucket.consume()